@@ -9,63 +9,63 @@ Copyright (C) 2024 Austin Berrio
 """
 
 import argparse
+import functools
+import heapq
 import json
-import re
-from collections import defaultdict
-from typing import Dict, List, Tuple
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from byte_pair.segment import read_preprocessed_text, segment_text
+from byte_pair.segment import segment_file, segment_text
 
 
-def map_tokens_to_words(vocab: Dict[str, int]) -> Dict[str, str]:
+def map_tokens_to_words(vocab: Dict[Tuple[str, ...], int]) -> Dict[str, List[str]]:
     """
     Map each token in the vocabulary to its original word.
 
     Args:
-        vocab (Dict[str, int]): The vocabulary object.
+        vocab (Dict[Tuple[str, ...], int]): The vocabulary object.
 
     Returns:
-        Dict[str, str]: A dictionary mapping each token to its original word.
+        Dict[str, List[str]]: A dictionary mapping each original word to its tokens.
     """
     token_to_word_map = {}
-    for word in vocab:
-        split_word = word.split()
-        original_word = "".join(split_word)
-        token_to_word_map[original_word] = split_word
+    for symbols in vocab:
+        original_word = "".join(symbols)
+        token_to_word_map[original_word] = list(symbols)
     return token_to_word_map
 
 
-def calculate_token_frequencies(vocab: Dict[str, int]) -> Dict[str, int]:
+def calculate_token_frequencies(vocab: Dict[Tuple[str, ...], int]) -> Dict[str, int]:
     """
     Calculate token frequencies based on the vocabulary.
 
     Args:
-        vocab (Dict[str, int]): The vocabulary object containing token frequency information.
+        vocab (Dict[Tuple[str, ...], int]): The vocabulary object containing token frequency information.
 
     Returns:
         Dict[str, int]: A dictionary mapping each token to its frequency.
     """
     token_frequencies = defaultdict(int)
-    for word, frequency in vocab.items():
-        for token in word.split():
+    for symbols, frequency in vocab.items():
+        for token in symbols:
             token_frequencies[token] += frequency
     return token_frequencies
 
 
-def get_stats(vocab: Dict[str, int]) -> Dict[Tuple[str, str], int]:
+def get_stats(vocab: Dict[Tuple[str, ...], int]) -> Dict[Tuple[str, str], int]:
     """
     Calculate frequencies of pairs of adjacent symbols in the vocabulary.
 
     Args:
-        vocab (dict): Dictionary with space-separated symbols as keys and frequencies as values
+        vocab (dict): Dictionary with symbol tuples as keys and frequencies as values
 
     Returns:
         dict: Dictionary of symbol pairs (tuple) and their combined frequency
     """
     symbol_pairs_frequency = defaultdict(int)
 
-    for word, frequency in vocab.items():
-        symbols = word.split()
+    for symbols, frequency in vocab.items():
         for index in range(len(symbols) - 1):
             symbol_pair = (symbols[index], symbols[index + 1])
             symbol_pairs_frequency[symbol_pair] += frequency
@@ -73,10 +73,44 @@ def get_stats(vocab: Dict[str, int]) -> Dict[Tuple[str, str], int]:
     return symbol_pairs_frequency
 
 
+def merge_symbols(
+    symbol_pair: Tuple[str, str],
+    symbols: Tuple[str, ...],
+) -> Tuple[str, ...]:
+    """
+    Merge every non-overlapping occurrence of a pair within a symbol sequence.
+
+    Args:
+        symbol_pair (tuple): Tuple of two strings, the pair of symbols to merge
+        symbols (tuple): The symbol sequence of a single word
+
+    Returns:
+        tuple: The symbol sequence with the specified pair merged
+    """
+    first, second = symbol_pair
+    merged = first + second
+    merged_symbols = []
+    index = 0
+
+    while index < len(symbols):
+        if (
+            index < len(symbols) - 1
+            and symbols[index] == first
+            and symbols[index + 1] == second
+        ):
+            merged_symbols.append(merged)
+            index += 2
+        else:
+            merged_symbols.append(symbols[index])
+            index += 1
+
+    return tuple(merged_symbols)
+
+
 def merge_vocab(
     symbol_pair: Tuple[str, str],
-    input_vocab: Dict[str, int],
-) -> Dict[str, int]:
+    input_vocab: Dict[Tuple[str, ...], int],
+) -> Dict[Tuple[str, ...], int]:
     """
     Merge a given pair of symbols in the vocabulary.
 
@@ -88,36 +122,205 @@ def merge_vocab(
         dict: New vocabulary with the specified pair merged
     """
     output_vocab = {}
-    bigram = re.escape(" ".join(symbol_pair))
-    pattern = re.compile(r"(?<!\S)" + bigram + r"(?!\S)")
 
-    for word in input_vocab:
-        merged_word = pattern.sub("".join(symbol_pair), word)
-        output_vocab[merged_word] = input_vocab[word]
+    for symbols, frequency in input_vocab.items():
+        output_vocab[merge_symbols(symbol_pair, symbols)] = frequency
 
     return output_vocab
 
 
-def prepare_vocab(segmented_text: List[str]) -> Dict[str, int]:
+def index_pairs(
+    words: List[List[str]],
+    freqs: List[int],
+) -> Tuple[Dict[Tuple[str, str], int], Dict[Tuple[str, str], Set[int]]]:
+    """
+    Count adjacent symbol pairs and record which words each pair occurs in.
+
+    Args:
+        words (List[List[str]]): Symbol sequence of each word in the vocabulary.
+        freqs (List[int]): Frequency of each word, parallel to words.
+
+    Returns:
+        Tuple[Dict[Tuple[str, str], int], Dict[Tuple[str, str], Set[int]]]: The pair
+        frequencies and an index mapping each pair to the ids of the words containing it.
+    """
+    pair_counts = defaultdict(int)
+    pair_to_words = defaultdict(set)
+
+    for word_id, (symbols, frequency) in enumerate(zip(words, freqs)):
+        for symbol_pair in zip(symbols, symbols[1:]):
+            pair_counts[symbol_pair] += frequency
+            pair_to_words[symbol_pair].add(word_id)
+
+    return pair_counts, pair_to_words
+
+
+def build_pair_heap(
+    pair_counts: Dict[Tuple[str, str], int],
+) -> List[Tuple[int, Tuple[str, str]]]:
+    """
+    Build a max-heap of pairs keyed on their frequencies.
+
+    Args:
+        pair_counts (dict): Dictionary of symbol pairs (tuple) and their frequency
+
+    Returns:
+        List[Tuple[int, Tuple[str, str]]]: A heap of (-frequency, pair) entries.
+    """
+    pair_heap = [(-count, symbol_pair) for symbol_pair, count in pair_counts.items()]
+    heapq.heapify(pair_heap)
+    return pair_heap
+
+
+def pop_best_pair(
+    pair_heap: List[Tuple[int, Tuple[str, str]]],
+    pair_counts: Dict[Tuple[str, str], int],
+) -> Optional[Tuple[str, str]]:
+    """
+    Pop the most frequent pair, breaking ties by the lexicographically smallest pair.
+
+    Entries are never removed when a count changes; a fresh entry is pushed
+    instead, so entries that disagree with the current count are skipped here.
+
+    Args:
+        pair_heap (list): Heap of (-frequency, pair) entries
+        pair_counts (dict): Dictionary of symbol pairs (tuple) and their frequency
+
+    Returns:
+        Optional[Tuple[str, str]]: The best pair, or None if no pairs remain.
+    """
+    while pair_heap:
+        negative_count, symbol_pair = heapq.heappop(pair_heap)
+        if pair_counts.get(symbol_pair, 0) == -negative_count:
+            return symbol_pair
+    return None
+
+
+def merge_pair(
+    symbol_pair: Tuple[str, str],
+    words: List[List[str]],
+    freqs: List[int],
+    pair_counts: Dict[Tuple[str, str], int],
+    pair_to_words: Dict[Tuple[str, str], Set[int]],
+    pair_heap: List[Tuple[int, Tuple[str, str]]],
+) -> None:
+    """
+    Merge a pair of symbols in place, updating the pair counts incrementally.
+
+    Only the words indexed under the pair are visited, and only the pairs adjacent
+    to each merged position are adjusted. The index may keep stale word ids for
+    pairs that no longer occur in a word; those words are simply left unchanged.
+
+    Args:
+        symbol_pair (tuple): Tuple of two strings, the pair of symbols to merge
+        words (List[List[str]]): Symbol sequence of each word, modified in place
+        freqs (List[int]): Frequency of each word, parallel to words
+        pair_counts (dict): Pair frequencies, modified in place
+        pair_to_words (dict): Index of word ids per pair, modified in place
+        pair_heap (list): Heap of (-frequency, pair) entries, pushed to for every changed pair
+    """
+    first, second = symbol_pair
+    merged = first + second
+    # Collect the count changes of this merge so each pair is updated once
+    deltas = defaultdict(int)
+
+    for word_id in pair_to_words.pop(symbol_pair, ()):
+        symbols = words[word_id]
+        if first not in symbols:
+            # Skip stale index entries
+            continue
+        frequency = freqs[word_id]
+        # Compact the word with separate read and write positions, so a merge
+        # never shifts the rest of the list
+        read = write = symbols.index(first)
+        length = len(symbols)
+        while read < length:
+            if (
+                read < length - 1
+                and symbols[read] == first
+                and symbols[read + 1] == second
+            ):
+                if write > 0:
+                    previous = symbols[write - 1]
+                    deltas[(previous, first)] -= frequency
+                    deltas[(previous, merged)] += frequency
+                    pair_to_words[(previous, merged)].add(word_id)
+                if read + 2 < length:
+                    following = symbols[read + 2]
+                    deltas[(second, following)] -= frequency
+                    deltas[(merged, following)] += frequency
+                    pair_to_words[(merged, following)].add(word_id)
+                symbols[write] = merged
+                read += 2
+            else:
+                symbols[write] = symbols[read]
+                read += 1
+            write += 1
+        del symbols[write:]
+
+    pair_counts.pop(symbol_pair, None)
+    deltas.pop(symbol_pair, None)
+
+    for changed_pair, delta in deltas.items():
+        if not delta:
+            continue
+        count = pair_counts.get(changed_pair, 0) + delta
+        if count > 0:
+            pair_counts[changed_pair] = count
+            heapq.heappush(pair_heap, (-count, changed_pair))
+        else:
+            # Drop exhausted pairs so they are never selected as the best pair
+            pair_counts.pop(changed_pair, None)
+
+
+def prepare_vocab(segmented_text: Iterable[str]) -> Dict[Tuple[str, ...], int]:
     """
     Prepare the initial vocabulary from segmented text with accurate frequencies.
 
     Args:
-        segmented_text (List[str]): List of words from the segmented text.
+        segmented_text (Iterable[str]): Words from the segmented text, consumed once.
 
     Returns:
-        Dict[str, int]: Dictionary with tokens as keys and frequencies as values.
-    """
-    vocab = defaultdict(int)
-    for word in segmented_text:
-        # Forming the token with spaces between characters and an end-of-word symbol
-        token = " ".join(word) + " </w>"
-        # Increment the frequency count for each occurrence
-        vocab[token] += 1
-    return vocab
+        Dict[Tuple[str, ...], int]: Dictionary with symbol tuples as keys and frequencies as values.
+    """
+    # Count each distinct word once, then form its token from its characters
+    # and an end-of-word symbol
+    word_frequencies = Counter(segmented_text)
+    return {
+        tuple(word) + ("</w>",): frequency
+        for word, frequency in word_frequencies.items()
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def _prepare_file_vocab(
+    input_file: str, mtime_ns: int, size: int
+) -> Dict[Tuple[str, ...], int]:
+    # mtime_ns and size are only part of the cache key, so edited files are read again.
+    return prepare_vocab(segment_file(input_file))
+
+
+def prepare_file_vocab(input_file: str) -> Dict[Tuple[str, ...], int]:
+    """
+    Prepare the initial vocabulary from a pre-processed text file.
+
+    The result is cached per file, modification time and size, so training
+    repeatedly on an unchanged file only segments it once.
+
+    Args:
+        input_file (str): Path to the file containing pre-processed text.
+
+    Returns:
+        Dict[Tuple[str, ...], int]: Dictionary with symbol tuples as keys and frequencies as values.
+    """
+    try:
+        stat = os.stat(input_file)
+    except IOError as e:
+        raise IOError(f"Error reading file {input_file}: {e}")
+    return dict(_prepare_file_vocab(input_file, stat.st_mtime_ns, stat.st_size))
 
 
-def read_vocab(input_file: str) -> Dict[str, int]:
+def read_vocab(input_file: str) -> Dict[Tuple[str, ...], int]:
     """
     Read vocabulary from a text file.
 
@@ -125,26 +328,30 @@ def read_vocab(input_file: str) -> Dict[str, int]:
         input_file (str): Path to the file containing vocabulary
 
     Returns:
-        dict: Dictionary with space-separated symbols as keys and frequencies as values
+        dict: Dictionary with symbol tuples as keys and frequencies as values
     """
     vocab = {}
     with open(input_file, "r", encoding="utf-8") as file:
         for line in file:
             word, freq = line.split()
-            vocab[word] = int(freq)
+            vocab[(word,)] = int(freq)
     return vocab
 
 
-def save_vocab(output_file: str, vocab: Dict[str, int]) -> None:
+def save_vocab(output_file: str, vocab: Dict[str, int], pretty: bool = False) -> None:
     """
     Write vocabulary to a JSON file.
 
     Args:
         output_file (str): Path to the file to write the vocabulary to
         vocab (dict): A dictionary containing the merged results
+        pretty (bool): If True, indent the JSON for reading instead of writing it compactly
     """
     with open(output_file, "w") as file:
-        json.dump(vocab, file, indent=4)
+        if pretty:
+            json.dump(vocab, file, indent=4)
+        else:
+            file.write(json.dumps(vocab, separators=(",", ":")))
 
 
 def main(args):
@@ -152,12 +359,12 @@ def main(args):
     Main function to run the BPE encoding.
 
     Args:
-        args (argparse.Namespace): Command-line arguments including input_file, output_file, and n_merges.
+        args (argparse.Namespace): Command-line arguments including input_file, output_file, n_merges, min_frequency, and verbose.
     """
     # Read vocabulary from input_file or use default vocabulary
     if args.input_file:
-        preprocessed_text = [line for line in read_preprocessed_text(args.input_file)]
-        segmented_text = segment_text(" ".join(preprocessed_text))
+        # Stream the file so only the word counts are held in memory
+        vocab = prepare_file_vocab(args.input_file)
     else:
         segmented_text = segment_text(
             "This is just an *example*.\n"
@@ -165,29 +372,37 @@ def main(args):
             "There is a _cool_ breeze today.\n"
             "There is a _warm_ breeze today.\n"
         )
+        vocab = prepare_vocab(segmented_text)
 
-    vocab = prepare_vocab(segmented_text)
-    print(segmented_text)
-    print(vocab)
+    # Printing the full vocabulary is costly on real corpora, so it is opt-in
+    if args.verbose:
+        print(vocab)
 
     # Set the number of merges or use the default value
     n_merges = args.n_merges if args.n_merges else 10
 
+    # Copy each word into a mutable symbol list; merges then update them in place
+    words = [list(symbols) for symbols in vocab]
+    freqs = list(vocab.values())
+    pair_counts, pair_to_words = index_pairs(words, freqs)
+    pair_heap = build_pair_heap(pair_counts)
+
     # Perform BPE merges
     for i in range(n_merges):
-        pairs = get_stats(vocab)
-        if not pairs:
+        best = pop_best_pair(pair_heap, pair_counts)
+        # Merging a pair seen fewer than min_frequency times adds no shared subword
+        if best is None or pair_counts[best] < args.min_frequency:
             break
-        best = max(pairs, key=pairs.get)
-        vocab = merge_vocab(best, vocab)
+        merge_pair(best, words, freqs, pair_counts, pair_to_words, pair_heap)
         # Uncomment the following line to print merge details
         print(f"Merge #{i + 1}: {best}")
 
+    vocab = {tuple(symbols): freq for symbols, freq in zip(words, freqs)}
     frequencies = calculate_token_frequencies(vocab)
 
     # Save the resulting vocabulary to the output file if specified
     if args.output_file:
-        save_vocab(args.output_file, frequencies)
+        save_vocab(args.output_file, frequencies, args.pretty)
 
 
 if __name__ == "__main__":
@@ -209,5 +424,21 @@ if __name__ == "__main__":
         type=int,
         help="Number of BPE merges to perform (optional, default is 10).",
     )
+    parser.add_argument(
+        "--min_frequency",
+        type=int,
+        default=2,
+        help="Stop merging once the best pair occurs fewer times (optional, default is 2).",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print the initial vocabulary before merging.",
+    )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Indent the saved vocabulary for reading (optional, default is compact).",
+    )
     args = parser.parse_args()
     main(args)
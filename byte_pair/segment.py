@@ -8,6 +8,7 @@ Copyright (C) 2024 Austin Berrio
 import argparse
 import json
 import re
+import sys
 from typing import Generator, List
 
 TOKEN_REGEX = re.compile(
@@ -25,6 +26,9 @@ TOKEN_REGEX = re.compile(
     re.VERBOSE | re.UNICODE,
 )
 
+# TOKEN_REGEX reduced to its last two alternatives, for text with no emails, URLs or apostrophes
+PLAIN_TOKEN_REGEX = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
 
 def read_preprocessed_text(input_file: str) -> Generator[str, None, None]:
     """
@@ -44,27 +48,38 @@ def read_preprocessed_text(input_file: str) -> Generator[str, None, None]:
         raise IOError(f"Error reading file {input_file}: {e}")
 
 
-def save_segmented_text(segments: List[str], output_file: str) -> None:
+def save_segmented_text(
+    segments: List[str], output_file: str, pretty: bool = False
+) -> None:
     """
     Write segmented text to a JSON file.
 
     Args:
         segments (List[str]): Segmented text.
         output_file (str): Path to the output JSON file.
+        pretty (bool, optional): If True, indent the JSON for reading instead of writing it compactly.
 
     Raises:
         IOError: If there's an error writing to the file.
     """
     try:
         with open(output_file, "w", encoding="utf-8") as file:
-            json.dump(segments, file, ensure_ascii=False, indent=4)
+            if pretty:
+                json.dump(segments, file, ensure_ascii=False, indent=4)
+            else:
+                file.write(
+                    json.dumps(segments, ensure_ascii=False, separators=(",", ":"))
+                )
     except IOError as e:
         raise IOError(f"Error writing to file {output_file}: {e}")
 
 
 def clean_text(corpus: str) -> str:
     """
-    Clean a given corpus by replacing multiple spaces with a single space and applying other cleaning rules as necessary.
+    Clean a given corpus by collapsing whitespace runs into single spaces and applying other cleaning rules as necessary.
+
+    Leading and trailing whitespace is stripped as well. segment_text does not call
+    this, since TOKEN_REGEX never matches whitespace and the tokens would be the same.
 
     Args:
         corpus (str): The input text corpus to be cleaned.
@@ -72,7 +87,7 @@ def clean_text(corpus: str) -> str:
     Returns:
         str: The cleaned text corpus.
     """
-    corpus = re.sub(r"\s+", " ", corpus)
+    corpus = " ".join(corpus.split())
     # Add other cleaning rules as necessary
     return corpus
 
@@ -90,29 +105,47 @@ def segment_text(corpus: str, lower: bool = False) -> List[str]:
     """
     if lower:
         corpus = corpus.lower()
-    corpus = clean_text(corpus)
+    # No whitespace cleanup is needed; none of the alternatives match whitespace
+    if "@" not in corpus and "://" not in corpus and "'" not in corpus:
+        # Without these characters no email, URL or apostrophe alternative can match
+        return PLAIN_TOKEN_REGEX.findall(corpus)
     return TOKEN_REGEX.findall(corpus)
 
 
-def main(args: argparse.Namespace) -> None:
+def segment_file(input_file: str, lower: bool = False) -> Generator[str, None, None]:
     """
-    Main function for segmenting text corpus using Byte-Pair Encoding (BPE).
+    Segment a pre-processed text file line by line without loading it into memory.
 
     Args:
-        args (argparse.Namespace): Command-line arguments including input_file, output_file, and lowercase.
+        input_file (str): Path to the file containing pre-processed text.
+        lower (bool, optional): If True, convert the text to lowercase before segmentation.
+
+    Yields:
+        Generator[str, None, None]: Yields one segmented token at a time.
     """
-    # Using generator to read preprocessed text line by line
-    preprocessed_text = [line for line in read_preprocessed_text(args.input_file)]
+    for line in read_preprocessed_text(input_file):
+        yield from segment_text(line, lower)
 
-    # Segmenting the text
-    segmented_text = segment_text(" ".join(preprocessed_text), args.lowercase)
 
+def main(args: argparse.Namespace) -> None:
+    """
+    Main function for segmenting text corpus using Byte-Pair Encoding (BPE).
+
+    Args:
+        args (argparse.Namespace): Command-line arguments including input_file, output_file, lowercase, and pretty.
+    """
     # Option to output to a file or stdout
     if args.output_file:
-        save_segmented_text(segmented_text, args.output_file)
+        # Segmenting the text line by line without joining the corpus into one string;
+        # the JSON array is written in one go, so collect the segments first
+        segmented_text = list(segment_file(args.input_file, args.lowercase))
+        save_segmented_text(segmented_text, args.output_file, args.pretty)
     else:
-        for seg in segmented_text:
-            print(seg)
+        # Stream segments to stdout one write per line rather than one print per segment
+        for line in read_preprocessed_text(args.input_file):
+            segments = segment_text(line, args.lowercase)
+            if segments:
+                sys.stdout.write("\n".join(segments) + "\n")
 
 
 if __name__ == "__main__":
@@ -135,5 +168,10 @@ if __name__ == "__main__":
         action="store_true",
         help="Convert text to lowercase before segmentation.",
     )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Indent the JSON output for reading (default is compact).",
+    )
     args = parser.parse_args()
     main(args)
@@ -11,9 +11,10 @@ Blog Tutorial: https://leimao.github.io/blog/Byte-Pair-Encoding/
 
 import argparse
 import collections
-import re
+import functools
+import heapq
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import tqdm
 
@@ -27,7 +28,7 @@ class TokenConstants:
 
 @dataclass
 class Vocabulary:
-    collection: Dict[str, int] = field(
+    collection: Dict[Tuple[str, ...], int] = field(
         default_factory=lambda: collections.defaultdict(int)
     )
     n_merges: Optional[int] = 10000
@@ -99,22 +100,46 @@ def map_corpus(vocab: Vocabulary) -> Tuple[Dict[str, int], Dict[str, str]]:
     vocab_frequency = collections.defaultdict(int)
     vocab_mapping = dict()
 
-    for word, frequency in vocab.collection.items():
-        split_word = word.split()  # Use space delimiter
-        original_word = "".join(split_word)  # Omit space delimiter
-        for token in split_word:
+    for symbols, frequency in vocab.collection.items():
+        original_word = "".join(symbols)
+        for token in symbols:
             vocab_frequency[token] += frequency
-        vocab_mapping[original_word] = split_word
+        vocab_mapping[original_word] = list(symbols)
 
     return vocab_frequency, vocab_mapping
 
 
-def get_vocabulary(corpus: List[str], **kwargs) -> Vocabulary:
+def iter_corpus_words(corpus: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the words of each line in the corpus, validating the lines as they are read.
+
+    Args:
+        corpus (Iterable[str]): Lines of the text corpus.
+
+    Yields:
+        str: The next word of the corpus.
+
+    Raises:
+        ValueError: If corpus is empty or contains non-string elements.
+    """
+    is_empty = True
+    for line in corpus:
+        if not isinstance(line, str):
+            raise ValueError("Corpus must be an iterable of strings.")
+        is_empty = False
+        # Break down the line into words.
+        yield from line.split()
+
+    if is_empty:
+        raise ValueError("Corpus must be an iterable of strings.")
+
+
+def get_vocabulary(corpus: Iterable[str], **kwargs) -> Vocabulary:
     """
     Get the vocabulary based on the given corpus.
 
     Args:
-        corpus (list): List of strings representing the text corpus.
+        corpus (Iterable[str]): Lines of the text corpus, e.g. a list of strings or an open file.
         kwargs (dict): Arguments passed to Vocabulary constructor.
 
     Returns:
@@ -123,19 +148,16 @@ def get_vocabulary(corpus: List[str], **kwargs) -> Vocabulary:
     Raises:
         ValueError: If corpus is empty or contains non-string elements.
     """
-    if not corpus or not all(isinstance(text, str) for text in corpus):
-        raise ValueError("Corpus must be a list of strings.")
-
     vocab = Vocabulary(**kwargs)
 
-    # Break down corpus into lines.
-    for line in corpus:
-        # Break down the line into words.
-        for word in line.split():
-            # Group space-separated characters by bounding them with a stop token.
-            token = " ".join(list(word)) + vocab.token_constants.stop
-            # Add token to vocab using a unique integer.
-            vocab.collection[token] += 1
+    # Stream the corpus line by line, counting each word once.
+    word_frequencies = collections.Counter(iter_corpus_words(corpus))
+
+    for word, frequency in word_frequencies.items():
+        # Group characters into symbols, bounding the last one with a stop token.
+        token = tuple(word[:-1]) + (word[-1] + vocab.token_constants.stop,)
+        # Add token to vocab using a unique integer.
+        vocab.collection[token] += frequency
 
     return vocab
 
@@ -152,9 +174,7 @@ def calculate_token_pair_frequencies(vocab: Vocabulary) -> Dict[Tuple[str, str],
     """
     token_pair_frequencies = collections.defaultdict(int)
 
-    for token, frequency in vocab.collection.items():
-        symbols = token.split()
-
+    for symbols, frequency in vocab.collection.items():
         for step in range(len(symbols) - 1):
             current_symbol = symbols[step]  # get current step
             next_symbol = symbols[step + 1]  # then get next step
@@ -164,6 +184,138 @@ def calculate_token_pair_frequencies(vocab: Vocabulary) -> Dict[Tuple[str, str],
     return token_pair_frequencies
 
 
+def index_token_pairs(
+    vocab: Vocabulary,
+) -> Dict[Tuple[str, str], Set[Tuple[str, ...]]]:
+    """
+    Index the tokens of the vocabulary by the token pairs they contain.
+
+    Args:
+        vocab (Vocabulary): The Vocabulary instance containing the token frequency information.
+
+    Returns:
+        dict: A dictionary mapping token pairs to the set of tokens containing them.
+    """
+    token_pair_index = collections.defaultdict(set)
+
+    for symbols in vocab.collection:
+        for pair in zip(symbols, symbols[1:]):
+            token_pair_index[pair].add(symbols)
+
+    return token_pair_index
+
+
+def build_token_pair_heap(
+    token_pair_frequencies: Dict[Tuple[str, str], int],
+) -> List[Tuple[int, Tuple[str, str]]]:
+    """
+    Build a max-heap of token pairs keyed on their frequencies.
+
+    Args:
+        token_pair_frequencies (dict): A dictionary mapping token pairs to their frequencies.
+
+    Returns:
+        List[Tuple[int, Tuple[str, str]]]: A heap of (-frequency, token pair) entries.
+    """
+    token_pair_heap = [
+        (-frequency, token_pair)
+        for token_pair, frequency in token_pair_frequencies.items()
+    ]
+    heapq.heapify(token_pair_heap)
+    return token_pair_heap
+
+
+def pop_top_token_pair(
+    token_pair_heap: List[Tuple[int, Tuple[str, str]]],
+    token_pair_frequencies: Dict[Tuple[str, str], int],
+) -> Optional[Tuple[str, str]]:
+    """
+    Pop the most frequent token pair, breaking ties by the lexicographically smallest pair.
+
+    Entries are never removed when a frequency changes; a fresh entry is pushed
+    instead, so entries that disagree with the current frequency are skipped here.
+
+    Args:
+        token_pair_heap (list): Heap of (-frequency, token pair) entries.
+        token_pair_frequencies (dict): A dictionary mapping token pairs to their frequencies.
+
+    Returns:
+        Optional[Tuple[str, str]]: The top token pair, or None if no pairs remain.
+    """
+    while token_pair_heap:
+        negative_frequency, token_pair = heapq.heappop(token_pair_heap)
+        if token_pair_frequencies.get(token_pair, 0) == -negative_frequency:
+            return token_pair
+    return None
+
+
+def update_token_pair_frequencies(
+    token_pair_frequencies: Dict[Tuple[str, str], int],
+    symbols: Tuple[str, ...],
+    merged_symbols: Tuple[str, ...],
+    frequency: int,
+    token_pair_heap: List[Tuple[int, Tuple[str, str]]],
+) -> None:
+    """
+    Replace the pair frequencies of a token's symbols with those of its merged symbols.
+
+    Args:
+        token_pair_frequencies (dict): The token pair frequencies, modified in place.
+        symbols (tuple): The symbols of the token before the merge.
+        merged_symbols (tuple): The symbols of the token after the merge.
+        frequency (int): The frequency of the token.
+        token_pair_heap (list): Heap of (-frequency, token pair) entries,
+            pushed to for every pair whose frequency changes.
+    """
+    deltas = collections.defaultdict(int)
+    for pair in zip(symbols, symbols[1:]):
+        deltas[pair] -= frequency
+    for pair in zip(merged_symbols, merged_symbols[1:]):
+        deltas[pair] += frequency
+
+    for pair, delta in deltas.items():
+        if not delta:
+            continue
+        pair_frequency = token_pair_frequencies.get(pair, 0) + delta
+        if pair_frequency > 0:
+            token_pair_frequencies[pair] = pair_frequency
+            heapq.heappush(token_pair_heap, (-pair_frequency, pair))
+        else:
+            # Drop exhausted pairs so they are never selected as the top pair
+            token_pair_frequencies.pop(pair, None)
+
+
+def merge_symbols(
+    symbols: Tuple[str, ...], token_pair: Tuple[str, str]
+) -> Tuple[str, ...]:
+    """
+    Merge every occurrence of a token pair within a token's symbols.
+
+    Args:
+        symbols (tuple): The symbols of the token.
+        token_pair (tuple): A tuple containing two strings representing the pair of tokens to merge.
+
+    Returns:
+        tuple: The symbols of the token with the pair merged.
+    """
+    first, second = token_pair
+    merged = first + second
+    merged_symbols = []
+    step = 0
+    while step < len(symbols):
+        if (
+            step < len(symbols) - 1
+            and symbols[step] == first
+            and symbols[step + 1] == second
+        ):
+            merged_symbols.append(merged)
+            step += 2
+        else:
+            merged_symbols.append(symbols[step])
+            step += 1
+    return tuple(merged_symbols)
+
+
 def merge_token_pair(vocab: Vocabulary, token_pair: Tuple[str, str]) -> Vocabulary:
     """
     Merge tokens in the vocabulary based on a given pair.
@@ -176,14 +328,9 @@ def merge_token_pair(vocab: Vocabulary, token_pair: Tuple[str, str]) -> Vocabula
         Vocabulary: The updated Vocabulary instance with merged tokens.
     """
     output_collection = collections.defaultdict(int)
-    lookbehind = r"(?<!\S)"
-    spaced_token_pair = re.escape(" ".join(token_pair))
-    lookahead = r"(?!\S)"
-    bigram_pattern = re.compile(lookbehind + spaced_token_pair + lookahead)
 
-    for token, frequency in vocab.collection.items():
-        merged_token_pair = bigram_pattern.sub("".join(token_pair), token)
-        output_collection[merged_token_pair] += frequency
+    for symbols, frequency in vocab.collection.items():
+        output_collection[merge_symbols(symbols, token_pair)] += frequency
 
     # Consider using
     #   vocab.collection = output_collection
@@ -195,6 +342,55 @@ def merge_token_pair(vocab: Vocabulary, token_pair: Tuple[str, str]) -> Vocabula
     )
 
 
+def merge_indexed_token_pair(
+    vocab: Vocabulary,
+    token_pair: Tuple[str, str],
+    token_pair_frequencies: Dict[Tuple[str, str], int],
+    token_pair_index: Dict[Tuple[str, str], Set[Tuple[str, ...]]],
+    token_pair_heap: List[Tuple[int, Tuple[str, str]]],
+) -> Vocabulary:
+    """
+    Merge a token pair in place, visiting only the tokens indexed under it.
+
+    The index may keep stale tokens that were merged away or no longer contain the
+    pair; those are skipped.
+
+    Args:
+        vocab (Vocabulary): The Vocabulary instance, whose collection is modified in place.
+        token_pair (tuple): A tuple containing two strings representing the pair of tokens to merge.
+        token_pair_frequencies (dict): Token pair frequencies, modified in place.
+        token_pair_index (dict): Index of tokens per token pair, modified in place.
+        token_pair_heap (list): Heap of (-frequency, token pair) entries to push
+            the updated frequencies to.
+
+    Returns:
+        Vocabulary: The same Vocabulary instance with merged tokens.
+    """
+    for symbols in token_pair_index.pop(token_pair, ()):
+        frequency = vocab.collection.get(symbols)
+        if frequency is None:
+            continue
+        merged_symbols = merge_symbols(symbols, token_pair)
+        if len(merged_symbols) == len(symbols):
+            continue
+
+        del vocab.collection[symbols]
+        vocab.collection[merged_symbols] = (
+            vocab.collection.get(merged_symbols, 0) + frequency
+        )
+        update_token_pair_frequencies(
+            token_pair_frequencies,
+            symbols,
+            merged_symbols,
+            frequency,
+            token_pair_heap,
+        )
+        for pair in zip(merged_symbols, merged_symbols[1:]):
+            token_pair_index[pair].add(merged_symbols)
+
+    return vocab
+
+
 def find_token_matches(token: str, string: str) -> List[Tuple[int, int]]:
     """
     Find all matches of a given token in the string.
@@ -206,8 +402,88 @@ def find_token_matches(token: str, string: str) -> List[Tuple[int, int]]:
     Returns:
         List[Tuple[int, int]]: A list of tuples representing the start and end positions of each match.
     """
-    token_reg = re.escape(token.replace(".", "[.]"))
-    return [(m.start(0), m.end(0)) for m in re.finditer(token_reg, string)]
+    if not token:
+        # An empty token matches at every position
+        return [(position, position) for position in range(len(string) + 1)]
+
+    matches = []
+    position = string.find(token)
+    while position != -1:
+        end = position + len(token)
+        matches.append((position, end))
+        # Continue after the match so that matches never overlap
+        position = string.find(token, end)
+    return matches
+
+
+@functools.lru_cache(maxsize=8)
+def build_token_trie(sorted_tokens: Tuple[str, ...]) -> dict:
+    """
+    Build a character trie over the sorted tokens.
+
+    Each node maps a character to its child node. A node that completes a token also
+    holds the token's rank in the sorted order under the None key, so that matching
+    can prefer the highest-priority token rather than simply the longest one.
+
+    Args:
+        sorted_tokens (Tuple[str, ...]): The sorted tokens in priority order.
+
+    Returns:
+        dict: The root node of the trie.
+    """
+    token_trie = {}
+    for rank, token in enumerate(sorted_tokens):
+        node = token_trie
+        for char in token:
+            node = node.setdefault(char, {})
+        # Keep the first rank if a token is listed more than once
+        node.setdefault(None, (rank, token))
+    return token_trie
+
+
+def match_tokens(
+    string: str,
+    token_trie: dict,
+    unknown_token: Optional[str] = "</u>",
+) -> List[str]:
+    """
+    Tokenize a string by walking the token trie from each position.
+
+    At every position the highest-priority token that matches is taken, exactly as a
+    scan of the sorted tokens would, but only the characters of the string are walked.
+
+    Args:
+        string (str): The string to tokenize.
+        token_trie (dict): The trie built from the sorted tokens.
+        unknown_token (str): The token to use for unknown sequences.
+
+    Returns:
+        List[str]: A list of tokens representing the tokenized string.
+    """
+    tokens = []
+    position = 0
+    while position < len(string):
+        node = token_trie
+        best = None
+        index = position
+        while index < len(string):
+            node = node.get(string[index])
+            if node is None:
+                break
+            index += 1
+            entry = node.get(None)
+            if entry is not None and (best is None or entry[0] < best[0]):
+                best = entry
+
+        if best is None:
+            # No matching token found; use unknown token and advance by one character
+            tokens.append(unknown_token)
+            position += 1
+        else:
+            tokens.append(best[1])
+            position += len(best[1])
+
+    return tokens
 
 
 def tokenize_substring(
@@ -229,21 +505,8 @@ def tokenize_substring(
     if substring == "":
         return []
 
-    tokens = []
-    i = 0
-    while i < len(substring):
-        # Find the longest token that matches the start of the substring
-        for token in sorted_tokens:
-            if substring[i:].startswith(token):
-                tokens.append(token)
-                i += len(token)
-                break
-        else:
-            # No matching token found; use unknown token and advance by one character
-            tokens.append(unknown_token)
-            i += 1
-
-    return tokens
+    token_trie = build_token_trie(tuple(sorted_tokens))
+    return match_tokens(substring, token_trie, unknown_token)
 
 
 def tokenize_string(
@@ -262,21 +525,7 @@ def tokenize_string(
     Returns:
         List[str]: A list of tokens representing the tokenized string.
     """
-    string_tokens = []
-    while string:
-        matched = False
-        for token in sorted_tokens:
-            if string.startswith(token):
-                string_tokens.append(token)
-                string = string[len(token) :]
-                matched = True
-                break
-
-        if not matched:
-            string_tokens.append(unknown_token)
-            string = string[1:]  # Move forward by one character
-
-    return string_tokens
+    return match_tokens(string, build_token_trie(tuple(sorted_tokens)), unknown_token)
 
 
 def tokenize(text: str) -> List[str]:
@@ -299,41 +548,42 @@ def main(args):
 
     with open(args.corpus_file, "r") as file:
         vocab = get_vocabulary(
-            corpus=file.readlines(),
+            corpus=file,
             n_merges=args.n_merges,
             token_constants=TokenConstants(),
         )
 
-    for _ in tqdm.tqdm(range(vocab.n_merges), desc="Merging vocabulary"):
-        vocab_frequency, vocab_mapping = map_corpus(vocab=vocab)
-        token_pair_frequencies = calculate_token_pair_frequencies(vocab=vocab)
+    # Count and index pairs once; each merge then updates only the tokens it changes
+    token_pair_frequencies = calculate_token_pair_frequencies(vocab=vocab)
+    token_pair_index = index_token_pairs(vocab=vocab)
+    token_pair_heap = build_token_pair_heap(token_pair_frequencies)
 
-        if not token_pair_frequencies:
+    for _ in tqdm.tqdm(range(vocab.n_merges), desc="Merging vocabulary"):
+        top_token_pair = pop_top_token_pair(token_pair_heap, token_pair_frequencies)
+        if top_token_pair is None:
             break
 
-        top_token_pair = max(token_pair_frequencies, key=token_pair_frequencies.get)
-        vocab = merge_token_pair(vocab=vocab, token_pair=top_token_pair)
+        vocab = merge_indexed_token_pair(
+            vocab=vocab,
+            token_pair=top_token_pair,
+            token_pair_frequencies=token_pair_frequencies,
+            token_pair_index=token_pair_index,
+            token_pair_heap=token_pair_heap,
+        )
+
+    # Map the merged vocabulary once, after the last merge
+    vocab_frequency, _ = map_corpus(vocab=vocab)
 
     sorted_tokens = sort_tokens(
         token_frequencies=vocab_frequency,
         token_constants=vocab.token_constants,
     )
-    given_token = args.given_token
-
-    if given_token in vocab_mapping:
-        # Tokenizer knows the given word
-        results: List[str] = tokenize_string(
-            string=given_token,
-            sorted_tokens=sorted_tokens,
-            unknown_token=vocab.token_constants.unknown,
-        )
-    else:
-        # Tokenizer failed to recognize the given word
-        results: List[str] = tokenize_string(
-            string=given_token,
-            sorted_tokens=sorted_tokens,
-            unknown_token=vocab.token_constants.unknown,
-        )
+    # Known and unknown words take the same path through the token trie
+    results: List[str] = tokenize_string(
+        string=args.given_token,
+        sorted_tokens=sorted_tokens,
+        unknown_token=vocab.token_constants.unknown,
+    )
 
     for result in results:
         print(result)
@@ -48,14 +48,22 @@ def merge_pairs(sequence: List[str], pair: Tuple[str, str]) -> List[str]:
         List: The sequence with the pairs merged.
     """
     merged_sequence = []
-
-    while sequence:
-        # Check if the pair is at the start of the sequence
-        if tuple(sequence[:2]) == pair:
+    first, second = pair
+    index = 0
+
+    # Walk the sequence once instead of popping from its front
+    while index < len(sequence):
+        # Check if the pair starts at the current position
+        if (
+            index < len(sequence) - 1
+            and sequence[index] == first
+            and sequence[index + 1] == second
+        ):
             merged_sequence.append(pair)
-            sequence = sequence[2:]
+            index += 2
         else:
-            merged_sequence.append(sequence.pop(0))
+            merged_sequence.append(sequence[index])
+            index += 1
 
     return merged_sequence
 
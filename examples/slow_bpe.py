@@ -9,8 +9,7 @@ Paper: https://arxiv.org/abs/1508.07909v5
 import argparse
 import collections
 import json
-import re
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 
 def get_stats(vocab: Dict[str, int]) -> Dict[Tuple[str, str], int]:
@@ -34,6 +33,26 @@ def get_stats(vocab: Dict[str, int]) -> Dict[Tuple[str, str], int]:
     return symbol_pairs_frequency
 
 
+def get_best_pair(pairs: Dict[Tuple[str, str], int]) -> Optional[Tuple[str, str]]:
+    """
+    Find the most frequent pair of symbols, preferring the first one seen on ties.
+
+    Args:
+        pairs (dict): Dictionary of symbol pairs (tuple) and their combined frequency
+
+    Returns:
+        tuple: The most frequent symbol pair, or None if there are no pairs
+    """
+    best_pair, best_frequency = None, 0
+
+    # A single pass over the items avoids a pairs.get lookup per key
+    for symbol_pair, frequency in pairs.items():
+        if best_pair is None or frequency > best_frequency:
+            best_pair, best_frequency = symbol_pair, frequency
+
+    return best_pair
+
+
 def merge_vocab(
     symbol_pair: Tuple[str, str], input_vocab: Dict[str, int]
 ) -> Dict[str, int]:
@@ -47,13 +66,26 @@ def merge_vocab(
     Returns:
         dict: New vocabulary with the specified pair merged
     """
+    first, second = symbol_pair
+    merged = first + second
     output_vocab = {}
-    bigram = re.escape(" ".join(symbol_pair))
-    pattern = re.compile(r"(?<!\S)" + bigram + r"(?!\S)")
 
-    for word in input_vocab:
-        merged_word = pattern.sub("".join(symbol_pair), word)
-        output_vocab[merged_word] = input_vocab[word]
+    for word, frequency in input_vocab.items():
+        symbols = word.split()
+        merged_symbols = []
+        index = 0
+        while index < len(symbols):
+            if (
+                index < len(symbols) - 1
+                and symbols[index] == first
+                and symbols[index + 1] == second
+            ):
+                merged_symbols.append(merged)
+                index += 2
+            else:
+                merged_symbols.append(symbols[index])
+                index += 1
+        output_vocab[" ".join(merged_symbols)] = frequency
 
     return output_vocab
 
@@ -91,7 +123,9 @@ def main(args: argparse.Namespace) -> None:
 
     for i in range(args.num_merges):
         pairs = get_stats(vocab)
-        best = max(pairs, key=pairs.get)
+        best = get_best_pair(pairs)
+        if best is None:
+            break
         vocab = merge_vocab(best, vocab)
         print(best)
 